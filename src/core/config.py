@@ -343,6 +343,11 @@ class Config:
         """Get Redis lock timeout in seconds"""
         return self._config.get("redis", {}).get("lock_timeout", 300)
 
+    @property
+    def redis_pool_size(self) -> int:
+        """Get Redis connection pool size (0 = auto)"""
+        return self._config.get("redis", {}).get("pool_size", 0)
+
     # Legacy aliases for backward compatibility
     @property
     def cloudflare_solver_enabled(self) -> bool:
@@ -1,8 +1,132 @@
 """Redis manager for distributed locking and caching"""
 import asyncio
+import functools
+import heapq
+import os
+import random
+import socket
+import time
+import zlib
+from functools import lru_cache
 from typing import Optional, Any
+from uuid import uuid4
+
+import msgpack
+
 from .config import config
 
+try:
+    from redis.exceptions import ConnectionError as RedisConnectionError
+    from redis.exceptions import NoScriptError as RedisNoScriptError
+    from redis.exceptions import ResponseError as RedisResponseError
+except ImportError:
+    RedisConnectionError = ConnectionError
+    RedisNoScriptError = Exception
+    RedisResponseError = Exception
+
+# Backoff bounds (seconds) for lock polling
+LOCK_RETRY_MIN_DELAY = 0.001
+LOCK_RETRY_MAX_DELAY = 1.0
+
+LOCK_PREFIX = "lock:"
+
+# Connections held for the manager's lifetime (the keyspace-event
+# subscription); added on top of the configured pool size
+DEDICATED_CONNECTIONS = 1
+
+# Identifies this host inside lock values without storing the full hostname
+_HOST_HASH = zlib.crc32(socket.gethostname().encode())
+
+# Local fallback cache bounds
+LOCAL_CACHE_MAXSIZE = 10000
+LOCAL_CACHE_SWEEP_INTERVAL = 1.0
+LOCAL_CACHE_COUNTER_LIMIT = 2 ** 20  # Access counters are halved past this
+
+# Locks held by this process are released with a plain DEL unless they are
+# this close (seconds) to expiring, in which case ownership is re-checked
+LOCK_OWNERSHIP_MARGIN = 1.0
+
+# Default TTL for watchdog-renewed locks; the watchdog extends it every third
+# of the TTL, so a crashed holder frees the lock within this many seconds
+WATCHDOG_LOCK_TIMEOUT = 30
+
+# How long a single keyspace-event read waits before looping (seconds)
+LOCK_EVENTS_READ_TIMEOUT = 1.0
+
+# Lazy connection setup: attempts per try, first backoff delay, and how long
+# operations stay on the local fallback after setup fails
+CONNECT_RETRY_ATTEMPTS = 3
+CONNECT_RETRY_DELAY = 0.1
+CONNECT_RETRY_COOLDOWN = 5.0
+
+# Release a lock only if it is still held by the caller
+_RELEASE_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+# Extend a lock's TTL only if it is still held by the caller
+_RENEW_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+else
+    return 0
+end
+"""
+
+# Take a lock and bump its concurrency counter (hash field ARGV[3]) in one round-trip
+_ACQUIRE_LUA = """
+if redis.call("set", KEYS[1], ARGV[1], "NX", "EX", ARGV[2]) then
+    return redis.call("hincrby", KEYS[2], ARGV[3], 1)
+else
+    return false
+end
+"""
+
+
+@lru_cache(maxsize=4096)
+def _token_key(token_id: int, lock_type: str) -> str:
+    """Lock name for a token, without the lock prefix"""
+    return f"token:{token_id}:{lock_type}"
+
+
+@lru_cache(maxsize=4096)
+def _concurrency_key(token_id: int) -> str:
+    """Concurrency counter hash for a token; one field per lock type"""
+    return f"concurrency:{token_id}"
+
+
+def _new_lock_value() -> bytes:
+    """
+    Build a unique lock value that also records who took the lock
+    
+    Packs (uuid, pid, host hash, unix time) with msgpack into ~32 bytes, so
+    holder metadata travels with the SET and needs no extra keys.
+    """
+    return msgpack.packb(
+        (uuid4().bytes, os.getpid(), _HOST_HASH, int(time.time())),
+        use_bin_type=True
+    )
+
+
+def _retry_on_connection_error(func):
+    """Retry a coroutine with exponential backoff on Redis connection errors"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        delay = CONNECT_RETRY_DELAY
+        for attempt in range(CONNECT_RETRY_ATTEMPTS):
+            try:
+                return await func(*args, **kwargs)
+            except RedisConnectionError:
+                if attempt == CONNECT_RETRY_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+    return wrapper
+
 
 class RedisManager:
     """Redis connection manager with fallback to local operations"""
@@ -10,9 +134,32 @@ class RedisManager:
     def __init__(self):
         self._client = None
         self._initialized = False
+        self._ready = False  # Connection-dependent setup done
+        self._connect_lock = asyncio.Lock()
+        self._connect_retry_at = 0.0
         self._local_locks: dict = {}  # Fallback local locks
-        self._local_cache: dict = {}  # Fallback local cache
+        self._local_cache: dict[str, list] = {}  # key -> [value, expiry, access_count]
+        self._local_cache_saturated = False  # Some access counter passed the limit
+        self._local_counters: dict[str, dict[str, int]] = {}  # Fallback concurrency counters (key -> field -> count)
+        self._expiry_heap: list[tuple[float, str]] = []  # (expiry, key) for _local_cache
+        self._sweeper_task: Optional[asyncio.Task] = None
         self._local_lock = asyncio.Lock()
+        self._local_lock_expiry: list[tuple[float, str, bytes]] = []  # (expiry, lock_key, lock_value)
+        self._local_lock_expiry_changed = asyncio.Event()
+        self._local_lock_sweeper_task: Optional[asyncio.Task] = None
+        self._local_lock_conds: dict[str, asyncio.Condition] = {}  # lock_key -> waiters, share _local_lock
+        self._lock_waiters: dict[str, asyncio.Event] = {}  # lock_key -> release event
+        self._lock_events_task: Optional[asyncio.Task] = None
+        self._release_script = None
+        self._renew_script = None
+        self._acquire_script = None
+        self._set_get_supported = True  # SET ... NX GET needs Redis >= 7.0
+        self._owned: dict[str, tuple[bytes, float]] = {}  # lock_key -> (lock_value, expiry) held by us
+        self._owned_tasks: dict[str, tuple[bytes, asyncio.Task]] = {}  # lock_key -> (lock_value, watchdog)
+        self._exists_batch: list[tuple[str, asyncio.Future]] = []
+        self._get_batch: list[tuple[str, asyncio.Future]] = []
+        self._batch_ready = asyncio.Event()
+        self._batch_task: Optional[asyncio.Task] = None
     
     async def initialize(self) -> bool:
         """Initialize Redis connection if enabled"""
@@ -23,42 +170,241 @@ class RedisManager:
         
         try:
             import redis.asyncio as redis
-            self._client = redis.Redis(
-                host=config.redis_host,
-                port=config.redis_port,
-                password=config.redis_password or None,
-                db=config.redis_db,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
-            # Test connection
-            await self._client.ping()
+        except ImportError as e:
+            print(f"⚠️ Redis client unavailable: {e}, falling back to local locks")
             self._initialized = True
+            return False
+        
+        # Blocking pool: callers wait for a free connection instead of erroring.
+        # Nothing connects here; the first operation does that in _ensure_client.
+        pool = redis.BlockingConnectionPool(
+            host=config.redis_host,
+            port=config.redis_port,
+            password=config.redis_password or None,
+            db=config.redis_db,
+            # Replies stay as bytes; lock values and counters never need str
+            decode_responses=False,
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            max_connections=(config.redis_pool_size or max(4, 2 * (os.cpu_count() or 1))) + DEDICATED_CONNECTIONS,
+            timeout=20
+        )
+        self._client = redis.Redis.from_pool(pool)
+        self._initialized = True
+        print(f"✅ Redis configured: {config.redis_host}:{config.redis_port} (connects on first use)")
+        return True
+    
+    async def _ensure_client(self) -> bool:
+        """
+        Make sure the Redis connection is set up, connecting on first use
+        
+        Public operations test self._ready before awaiting this, so once
+        connected the check costs an attribute read rather than a coroutine.
+        
+        Returns:
+            True if Redis is usable, False if the caller should use the local fallback
+        """
+        if self._ready:
+            return True
+        if self._client is None or time.monotonic() < self._connect_retry_at:
+            return False
+        # Don't queue request traffic behind a connect attempt that may take
+        # seconds; callers use the local fallback until it finishes
+        if self._connect_lock.locked():
+            return False
+        
+        async with self._connect_lock:
+            try:
+                await self._connect()
+            except Exception as e:
+                print(f"⚠️ Redis connection failed: {e}, using local fallback for {CONNECT_RETRY_COOLDOWN}s")
+                self._connect_retry_at = time.monotonic() + CONNECT_RETRY_COOLDOWN
+                return False
+            self._ready = True
             print(f"✅ Redis connected: {config.redis_host}:{config.redis_port}")
             return True
+    
+    @_retry_on_connection_error
+    async def _connect(self):
+        """Set up connection-dependent state; each step is skipped once done"""
+        if self._acquire_script is None:
+            await self._load_scripts()
+        if self._lock_events_task is None:
+            await self._start_lock_events()
+        if self._batch_task is None:
+            self._batch_task = asyncio.create_task(self._batch_worker())
+    
+    async def _batched(self, batch: list, key: str):
+        """Queue a read for the batch worker and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        batch.append((key, future))
+        self._batch_ready.set()
+        return await future
+    
+    async def _batch_worker(self):
+        """
+        Flush queued EXISTS/GET reads as a single pipelined round-trip
+        
+        A read that finds the worker idle goes out at once. Reads arriving
+        while a flush is on the wire queue up and share the next one, so
+        coalescing never adds latency beyond the round-trip already pending.
+        """
+        while True:
+            await self._batch_ready.wait()
+            self._batch_ready.clear()
+            exists_batch, self._exists_batch = self._exists_batch, []
+            get_batch, self._get_batch = self._get_batch, []
+            if not exists_batch and not get_batch:
+                continue
+            
+            try:
+                async with self._client.pipeline(transaction=False) as pipe:
+                    for key, _ in exists_batch:
+                        pipe.exists(key)
+                    if get_batch:
+                        pipe.mget([key for key, _ in get_batch])
+                    results = await pipe.execute()
+            except asyncio.CancelledError:
+                for _, future in exists_batch + get_batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in exists_batch + get_batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), count in zip(exists_batch, results):
+                if not future.done():
+                    future.set_result(count > 0)
+            if get_batch:
+                for (_, future), value in zip(get_batch, results[-1]):
+                    if not future.done():
+                        future.set_result(value)
+    
+    async def _load_scripts(self):
+        """Register Lua scripts and preload them so calls go straight to EVALSHA"""
+        release_script = self._client.register_script(_RELEASE_LUA)
+        renew_script = self._client.register_script(_RENEW_LUA)
+        acquire_script = self._client.register_script(_ACQUIRE_LUA)
+        for script in (release_script, renew_script, acquire_script):
+            await self._client.script_load(script.script)
+        self._release_script = release_script
+        self._renew_script = renew_script
+        self._acquire_script = acquire_script
+    
+    async def _start_lock_events(self):
+        """Enable keyspace notifications and start the lock event listener"""
+        try:
+            # Merge our flags into the server-wide setting instead of replacing it
+            values = await self._client.config_get("notify-keyspace-events")
+            current = next(iter(values.values()), b"").decode()
+            # "A" is an alias that already includes g and x
+            missing = "".join(
+                flag for flag in "Kgx"
+                if flag not in current and not (flag != "K" and "A" in current)
+            )
+            if missing:
+                await self._client.config_set("notify-keyspace-events", current + missing)
         except Exception as e:
-            print(f"⚠️ Redis connection failed: {e}, falling back to local locks")
-            self._client = None
-            self._initialized = True
-            return False
+            # Managed Redis often forbids CONFIG; notifications may already be enabled
+            print(f"⚠️ Could not enable keyspace notifications: {e}")
+        
+        self._lock_events_task = asyncio.create_task(self._listen_lock_events())
+    
+    async def _listen_lock_events(self):
+        """Wake waiters registered for a lock key when it is deleted or expires"""
+        pattern = f"__keyspace@{config.redis_db}__:lock:*"
+        delay = CONNECT_RETRY_DELAY
+        while True:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(pattern)
+                delay = CONNECT_RETRY_DELAY
+                while True:
+                    # Bounded reads return None when idle instead of tripping
+                    # the pool's socket_timeout and killing the subscription
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=LOCK_EVENTS_READ_TIMEOUT
+                    )
+                    if message is None or message.get("type") != "pmessage":
+                        continue
+                    if message["data"] not in (b"del", b"expired"):
+                        continue
+                    lock_key = message["channel"].split(b"__:", 1)[1].decode()
+                    event = self._lock_waiters.pop(lock_key, None)
+                    if event:
+                        event.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Waiters keep their backoff-bounded polling until we resubscribe
+                print(f"⚠️ Lock event listener failed: {e}, resubscribing in {delay:.1f}s")
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_RETRY_MAX_DELAY)
+    
+    async def _wait_lock_release(self, lock_key: str, timeout: float):
+        """Wait until lock_key is released or timeout elapses"""
+        if self._lock_events_task is None:
+            await asyncio.sleep(timeout)
+            return
+        
+        event = self._lock_waiters.get(lock_key)
+        if event is None:
+            event = self._lock_waiters[lock_key] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
     
     async def close(self):
         """Close Redis connection"""
+        for _, task in self._owned_tasks.values():
+            task.cancel()
+        self._owned_tasks.clear()
+        if self._sweeper_task:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+        if self._local_lock_sweeper_task:
+            self._local_lock_sweeper_task.cancel()
+            self._local_lock_sweeper_task = None
+        if self._lock_events_task:
+            self._lock_events_task.cancel()
+            self._lock_events_task = None
+        for event in self._lock_waiters.values():
+            event.set()
+        self._lock_waiters.clear()
+        if self._batch_task:
+            self._batch_task.cancel()
+            self._batch_task = None
+        for _, future in self._exists_batch + self._get_batch:
+            future.cancel()
+        self._exists_batch.clear()
+        self._get_batch.clear()
         if self._client:
-            await self._client.close()
+            await self._client.aclose()
             self._client = None
+        # Drop state bound to the closed client so a later initialize() redoes setup
+        self._release_script = None
+        self._renew_script = None
+        self._acquire_script = None
+        self._set_get_supported = True
+        self._owned.clear()
+        self._connect_retry_at = 0.0
+        self._ready = False
         self._initialized = False
     
     @property
     def is_connected(self) -> bool:
-        """Check if Redis is connected"""
+        """Check if Redis is configured (the connection itself is made lazily)"""
         return self._client is not None
     
     # ==================== Distributed Lock Operations ====================
     
     async def acquire_lock(self, key: str, timeout: int = None, blocking: bool = True, 
-                          wait_timeout: float = None) -> Optional[str]:
+                          wait_timeout: float = None, watchdog: bool = False) -> Optional[bytes]:
         """
         Acquire a distributed lock
         
@@ -67,60 +413,214 @@ class RedisManager:
             timeout: Lock expiration time in seconds
             blocking: Whether to wait for lock
             wait_timeout: Maximum time to wait for lock
+            watchdog: Keep renewing the lock until it is released, so timeout
+                only bounds how long a crashed holder blocks others
+                (defaults to WATCHDOG_LOCK_TIMEOUT)
             
         Returns:
-            Lock value (UUID) if acquired, None otherwise
+            Lock value (opaque bytes) if acquired, None otherwise
         """
-        import uuid
-        lock_key = f"lock:{key}"
-        lock_value = str(uuid.uuid4())
-        timeout = timeout or config.redis_lock_timeout
+        lock_key = LOCK_PREFIX + key
+        lock_value = _new_lock_value()
+        timeout = timeout or (WATCHDOG_LOCK_TIMEOUT if watchdog else config.redis_lock_timeout)
         wait_timeout = wait_timeout or timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_timeout
+        delay = LOCK_RETRY_MIN_DELAY
         
-        if self._client:
+        if self._ready or await self._ensure_client():
             # Use Redis
-            start_time = asyncio.get_event_loop().time()
             while True:
-                acquired = await self._client.set(
-                    lock_key, lock_value, nx=True, ex=timeout
-                )
+                sent_at = time.monotonic()
+                acquired, _ = await self._set_nx(lock_key, lock_value, timeout)
                 if acquired:
+                    self._track_owned(lock_key, lock_value, timeout, sent_at)
+                    if watchdog:
+                        self._start_watchdog(lock_key, lock_value, timeout)
                     return lock_value
                 
                 if not blocking:
                     return None
                 
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed >= wait_timeout:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
                     return None
                 
-                await asyncio.sleep(0.1)
+                # Released locks wake us via keyspace events; backoff bounds the
+                # wait in case a notification is missed
+                await self._wait_lock_release(lock_key, self._backoff_delay(delay, remaining))
+                delay = min(delay * 2, LOCK_RETRY_MAX_DELAY)
         else:
             # Fallback to local lock
             async with self._local_lock:
-                if lock_key in self._local_locks:
+                while lock_key in self._local_locks:
                     if not blocking:
                         return None
-                    # Wait for lock (simplified)
-                    start_time = asyncio.get_event_loop().time()
-                    while lock_key in self._local_locks:
-                        await asyncio.sleep(0.1)
-                        if asyncio.get_event_loop().time() - start_time >= wait_timeout:
-                            return None
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return None
+                    # Releasers notify this condition, so we wake immediately
+                    cond = self._local_lock_conds.get(lock_key)
+                    if cond is None:
+                        cond = self._local_lock_conds[lock_key] = asyncio.Condition(self._local_lock)
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        return None
                 
                 self._local_locks[lock_key] = lock_value
-                # Schedule auto-release
-                asyncio.create_task(self._auto_release_local_lock(lock_key, timeout))
+                # In-process locks die with the process, so a watchdog
+                # lock simply never expires locally
+                if not watchdog:
+                    self._schedule_local_lock_expiry(lock_key, lock_value, timeout)
                 return lock_value
     
-    async def _auto_release_local_lock(self, key: str, timeout: int):
-        """Auto-release local lock after timeout"""
-        await asyncio.sleep(timeout)
-        async with self._local_lock:
-            if key in self._local_locks:
-                del self._local_locks[key]
+    async def try_acquire_lock(self, key: str, timeout: int = None) -> tuple[Optional[bytes], Optional[bytes]]:
+        """
+        Try once to acquire a lock, reporting the current holder on failure
+        
+        Lets callers replace an is_locked() check followed by acquire_lock()
+        with a single round-trip.
+        
+        Returns:
+            (lock_value, None) if acquired, otherwise (None, holder_value).
+            holder_value is None when the server is too old to report it.
+        """
+        lock_key = LOCK_PREFIX + key
+        lock_value = _new_lock_value()
+        timeout = timeout or config.redis_lock_timeout
+        
+        if self._ready or await self._ensure_client():
+            sent_at = time.monotonic()
+            acquired, holder = await self._set_nx(lock_key, lock_value, timeout)
+            if acquired:
+                self._track_owned(lock_key, lock_value, timeout, sent_at)
+                return lock_value, None
+            return None, holder
+        else:
+            async with self._local_lock:
+                holder = self._local_locks.get(lock_key)
+                if holder is not None:
+                    return None, holder
+                self._local_locks[lock_key] = lock_value
+                self._schedule_local_lock_expiry(lock_key, lock_value, timeout)
+                return lock_value, None
+    
+    async def _set_nx(self, lock_key: str, lock_value: bytes, timeout: int) -> tuple[bool, Optional[bytes]]:
+        """
+        SET NX EX that also returns the current holder's value
+        
+        Uses Redis 7's SET ... NX GET, which returns the old value atomically.
+        Older servers reject NX with GET; we then fall back to plain SET NX
+        for the rest of the process lifetime.
+        
+        Returns:
+            (acquired, holder_value)
+        """
+        if self._set_get_supported:
+            try:
+                holder = await self._client.set(lock_key, lock_value, nx=True, ex=timeout, get=True)
+                return holder is None, holder
+            except RedisResponseError as e:
+                if "syntax" not in str(e).lower():
+                    raise
+                self._set_get_supported = False
+        acquired = await self._client.set(lock_key, lock_value, nx=True, ex=timeout)
+        return bool(acquired), None
+    
+    def _start_watchdog(self, lock_key: str, lock_value: bytes, timeout: int):
+        """Start renewing a lock in the background until it is released"""
+        task = asyncio.create_task(self._watchdog(lock_key, lock_value, timeout))
+        self._owned_tasks[lock_key] = (lock_value, task)
+    
+    def _stop_watchdog(self, lock_key: str, lock_value: bytes):
+        """Cancel the watchdog for a lock, if we run one for this holder"""
+        owned = self._owned_tasks.get(lock_key)
+        if owned is not None and owned[0] == lock_value:
+            del self._owned_tasks[lock_key]
+            owned[1].cancel()
+    
+    async def _watchdog(self, lock_key: str, lock_value: bytes, timeout: int):
+        """Extend a lock's TTL every timeout/3 while we still hold it"""
+        try:
+            while True:
+                await asyncio.sleep(timeout / 3)
+                sent_at = time.monotonic()
+                try:
+                    renewed = await self._renew_script(keys=[lock_key], args=[lock_value, timeout])
+                except Exception as e:
+                    print(f"⚠️ Failed to renew Redis lock {lock_key}: {e}")
+                    continue
+                if not renewed:
+                    # Lock expired or was taken over; nothing left to renew
+                    break
+                self._track_owned(lock_key, lock_value, timeout, sent_at)
+        finally:
+            owned = self._owned_tasks.get(lock_key)
+            if owned is not None and owned[1] is asyncio.current_task():
+                del self._owned_tasks[lock_key]
     
-    async def release_lock(self, key: str, lock_value: str) -> bool:
+    def _track_owned(self, lock_key: str, lock_value: bytes, timeout: int, sent_at: float):
+        """
+        Remember a lock this process just acquired or renewed
+        
+        sent_at is time.monotonic() from before the command went out. Redis
+        starts the TTL when it runs the command, so timing from the reply
+        would let a slow reply or loop stall push our deadline past the
+        real expiry.
+        """
+        self._owned[lock_key] = (lock_value, sent_at + timeout - LOCK_OWNERSHIP_MARGIN)
+    
+    def _release_owned(self, lock_key: str, lock_value: bytes) -> bool:
+        """Forget a tracked lock; True if it is still ours and safely before expiry"""
+        owned = self._owned.get(lock_key)
+        if owned is None or owned[0] != lock_value:
+            return False
+        del self._owned[lock_key]
+        return time.monotonic() < owned[1]
+    
+    @staticmethod
+    def _backoff_delay(delay: float, remaining: float) -> float:
+        """Jittered backoff delay, clamped so we never sleep past the deadline"""
+        return min(delay + random.uniform(0, delay / 2), remaining)
+    
+    def _schedule_local_lock_expiry(self, lock_key: str, lock_value: bytes, timeout: int):
+        """Queue a local lock for auto-release by the sweeper"""
+        entry = (time.monotonic() + timeout, lock_key, lock_value)
+        heapq.heappush(self._local_lock_expiry, entry)
+        if self._local_lock_expiry[0] is entry:
+            # New earliest deadline: wake the sweeper so it re-arms its timer
+            self._local_lock_expiry_changed.set()
+        if self._local_lock_sweeper_task is None:
+            self._local_lock_sweeper_task = asyncio.create_task(self._local_lock_sweeper())
+    
+    async def _local_lock_sweeper(self):
+        """Single background task that auto-releases expired local locks"""
+        heap = self._local_lock_expiry
+        while True:
+            self._local_lock_expiry_changed.clear()
+            wait = heap[0][0] - time.monotonic() if heap else None
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self._local_lock_expiry_changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, lock_key, lock_value = heapq.heappop(heap)
+            async with self._local_lock:
+                # Only release if nobody released and re-acquired it meanwhile
+                if self._local_locks.get(lock_key) == lock_value:
+                    self._release_local_lock(lock_key)
+    
+    def _release_local_lock(self, lock_key: str):
+        """Drop a local lock and wake its waiters; caller holds _local_lock"""
+        del self._local_locks[lock_key]
+        cond = self._local_lock_conds.pop(lock_key, None)
+        if cond is not None:
+            cond.notify_all()
+    
+    async def release_lock(self, key: str, lock_value: bytes) -> bool:
         """
         Release a distributed lock
         
@@ -131,86 +631,182 @@ class RedisManager:
         Returns:
             True if released, False otherwise
         """
-        lock_key = f"lock:{key}"
+        lock_key = LOCK_PREFIX + key
         
-        if self._client:
-            # Use Lua script to ensure atomic release
-            lua_script = """
-            if redis.call("get", KEYS[1]) == ARGV[1] then
-                return redis.call("del", KEYS[1])
-            else
-                return 0
-            end
-            """
+        # A lock taken during local fallback is released locally, even if
+        # Redis has connected since
+        if await self._release_local_if_held(lock_key, lock_value):
+            return True
+        
+        if self._ready or await self._ensure_client():
+            self._stop_watchdog(lock_key, lock_value)
             try:
-                result = await self._client.eval(lua_script, 1, lock_key, lock_value)
+                if self._release_owned(lock_key, lock_value):
+                    # We took this lock and it cannot have expired yet: skip the GET
+                    return await self._client.delete(lock_key) == 1
+                # Use Lua script to ensure atomic release
+                result = await self._release_script(keys=[lock_key], args=[lock_value])
                 return result == 1
             except Exception as e:
                 print(f"⚠️ Failed to release Redis lock: {e}")
                 return False
-        else:
-            # Fallback to local lock
-            async with self._local_lock:
-                if self._local_locks.get(lock_key) == lock_value:
-                    del self._local_locks[lock_key]
-                    return True
-                return False
+        return False
+    
+    async def _release_local_if_held(self, lock_key: str, lock_value: bytes) -> bool:
+        """Release a local lock if lock_value holds it; True if released"""
+        if self._local_locks.get(lock_key) != lock_value:
+            return False
+        async with self._local_lock:
+            if self._local_locks.get(lock_key) == lock_value:
+                self._release_local_lock(lock_key)
+                return True
+            return False
     
     async def is_locked(self, key: str) -> bool:
         """Check if a key is locked"""
-        lock_key = f"lock:{key}"
+        lock_key = LOCK_PREFIX + key
         
-        if self._client:
+        if self._ready or await self._ensure_client():
+            if self._batch_task:
+                return await self._batched(self._exists_batch, lock_key)
             return await self._client.exists(lock_key) > 0
         else:
             return lock_key in self._local_locks
     
+    async def inspect_lock(self, key: str) -> Optional[dict]:
+        """
+        Describe who holds a lock
+        
+        Returns:
+            Dict with id, pid, host_hash and acquired_at (unix time),
+            or None if the lock is free or its value is not in our format
+        """
+        lock_key = LOCK_PREFIX + key
+        if self._ready or await self._ensure_client():
+            value = await self._client.get(lock_key)
+        else:
+            value = self._local_locks.get(lock_key)
+        if value is None:
+            return None
+        try:
+            fields = msgpack.unpackb(value, raw=False, use_list=False)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            return None
+        # Foreign values can still decode to a 4-item sequence of other types
+        if not (isinstance(fields, tuple) and len(fields) == 4 and isinstance(fields[0], bytes)
+                and all(type(field) is int for field in fields[1:])):
+            return None
+        lock_id, pid, host_hash, acquired_at = fields
+        return {
+            "id": lock_id.hex(),
+            "pid": pid,
+            "host_hash": host_hash,
+            "acquired_at": acquired_at
+        }
+    
     # ==================== Cache Operations ====================
     
-    async def get(self, key: str) -> Optional[str]:
-        """Get a value from cache"""
-        if self._client:
-            return await self._client.get(key)
+    async def get(self, key: str, decode: bool = False) -> Optional[Any]:
+        """
+        Get a value from cache
+        
+        Redis values come back as bytes; pass decode=True to get str.
+        """
+        if self._ready or await self._ensure_client():
+            if self._batch_task:
+                value = await self._batched(self._get_batch, key)
+            else:
+                value = await self._client.get(key)
         else:
-            return self._local_cache.get(key)
+            value = self._local_get(key)
+            # Match the Redis path, which always returns bytes
+            if isinstance(value, str):
+                value = value.encode()
+        if decode and isinstance(value, bytes):
+            return value.decode()
+        return value
     
     async def set(self, key: str, value: str, ex: int = None) -> bool:
         """Set a value in cache"""
-        if self._client:
+        if self._ready or await self._ensure_client():
             return await self._client.set(key, value, ex=ex)
         else:
-            self._local_cache[key] = value
-            if ex:
-                asyncio.create_task(self._auto_expire_local_cache(key, ex))
+            self._local_set(key, value, ex)
             return True
     
-    async def _auto_expire_local_cache(self, key: str, ex: int):
-        """Auto-expire local cache after timeout"""
-        await asyncio.sleep(ex)
-        if key in self._local_cache:
+    def _local_get(self, key: str) -> Optional[Any]:
+        """Read from the local cache, treating expired entries as missing"""
+        entry = self._local_cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
             del self._local_cache[key]
+            return None
+        # Bump the access counter in place; no reordering on hit
+        entry[2] += 1
+        if entry[2] > LOCAL_CACHE_COUNTER_LIMIT and not self._local_cache_saturated:
+            self._local_cache_saturated = True
+            self._start_local_sweeper()
+        return entry[0]
+    
+    def _local_set(self, key: str, value: Any, ex: int = None):
+        """Write to the local cache, evicting the least accessed entry past the bound"""
+        expiry = time.monotonic() + ex if ex else None
+        entry = self._local_cache.get(key)
+        if entry is not None:
+            entry[0] = value
+            entry[1] = expiry
+        else:
+            if len(self._local_cache) >= LOCAL_CACHE_MAXSIZE:
+                victim = min(self._local_cache.items(), key=lambda item: item[1][2])[0]
+                del self._local_cache[victim]
+            self._local_cache[key] = [value, expiry, 1]
+        if expiry is not None:
+            heapq.heappush(self._expiry_heap, (expiry, key))
+            self._start_local_sweeper()
+    
+    def _start_local_sweeper(self):
+        """Start the local cache sweeper if it is not already running"""
+        if self._sweeper_task is None:
+            self._sweeper_task = asyncio.create_task(self._sweep_local_cache())
+    
+    async def _sweep_local_cache(self):
+        """Single background task that expires local entries and ages access counters"""
+        while True:
+            await asyncio.sleep(LOCAL_CACHE_SWEEP_INTERVAL)
+            now = time.monotonic()
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expiry, key = heapq.heappop(heap)
+                entry = self._local_cache.get(key)
+                # Skip heap entries made stale by a later set() or eviction
+                if entry is not None and entry[1] == expiry:
+                    del self._local_cache[key]
+            if self._local_cache_saturated:
+                for entry in self._local_cache.values():
+                    entry[2] >>= 1
+                self._local_cache_saturated = False
     
     async def delete(self, key: str) -> bool:
         """Delete a key from cache"""
-        if self._client:
+        if self._ready or await self._ensure_client():
             return await self._client.delete(key) > 0
         else:
-            if key in self._local_cache:
-                del self._local_cache[key]
-                return True
-            return False
+            return self._local_cache.pop(key, None) is not None
     
     async def exists(self, key: str) -> bool:
         """Check if a key exists"""
-        if self._client:
+        if self._ready or await self._ensure_client():
+            if self._batch_task:
+                return await self._batched(self._exists_batch, key)
             return await self._client.exists(key) > 0
         else:
-            return key in self._local_cache
+            return self._local_get(key) is not None
     
     # ==================== Token Lock Operations ====================
     
     async def acquire_token_lock(self, token_id: int, lock_type: str = "image", 
-                                 timeout: int = 300) -> Optional[str]:
+                                 timeout: int = 300, watchdog: bool = False) -> Optional[bytes]:
         """
         Acquire a lock for a specific token
         
@@ -218,21 +814,100 @@ class RedisManager:
             token_id: Token ID
             lock_type: Lock type (image/video)
             timeout: Lock timeout in seconds
+            watchdog: Renew the lock in the background until released
             
         Returns:
             Lock value if acquired, None otherwise
         """
-        key = f"token:{token_id}:{lock_type}"
-        return await self.acquire_lock(key, timeout=timeout, blocking=False)
+        key = _token_key(token_id, lock_type)
+        return await self.acquire_lock(key, timeout=timeout, blocking=False, watchdog=watchdog)
     
-    async def release_token_lock(self, token_id: int, lock_type: str, lock_value: str) -> bool:
+    async def release_token_lock(self, token_id: int, lock_type: str, lock_value: bytes) -> bool:
         """Release a token lock"""
-        key = f"token:{token_id}:{lock_type}"
+        key = _token_key(token_id, lock_type)
         return await self.release_lock(key, lock_value)
     
+    async def acquire_token_lock_and_incr(self, token_id: int, lock_type: str = "image",
+                                          timeout: int = 300) -> Optional[bytes]:
+        """
+        Acquire a token lock and increment its concurrency counter atomically
+        
+        Args:
+            token_id: Token ID
+            lock_type: Lock type (image/video)
+            timeout: Lock timeout in seconds
+            
+        Returns:
+            Lock value if acquired, None otherwise
+        """
+        key = _token_key(token_id, lock_type)
+        if self._ready or await self._ensure_client():
+            lock_value = _new_lock_value()
+            lock_key = LOCK_PREFIX + key
+            sent_at = time.monotonic()
+            result = await self._acquire_script(
+                keys=[lock_key, _concurrency_key(token_id)],
+                args=[lock_value, timeout, lock_type]
+            )
+            if not result:
+                return None
+            self._track_owned(lock_key, lock_value, timeout, sent_at)
+            return lock_value
+        else:
+            lock_value = await self.acquire_lock(key, timeout=timeout, blocking=False)
+            if lock_value:
+                await self.increment_concurrency(token_id, lock_type)
+            return lock_value
+    
+    async def release_token_lock_and_decr(self, token_id: int, lock_type: str, lock_value: bytes) -> bool:
+        """
+        Release a token lock and decrement its concurrency counter
+        
+        Both commands are pipelined so they share a single round-trip.
+        
+        Returns:
+            True if the lock was released, False otherwise
+        """
+        key = _token_key(token_id, lock_type)
+        lock_key = LOCK_PREFIX + key
+        # Taken during local fallback: the lock and its counter both live locally
+        if await self._release_local_if_held(lock_key, lock_value):
+            await self.decrement_concurrency(token_id, lock_type)
+            return True
+        
+        if self._ready or await self._ensure_client():
+            concurrency_key = _concurrency_key(token_id)
+            self._stop_watchdog(lock_key, lock_value)
+            try:
+                async with self._client.pipeline(transaction=False) as pipe:
+                    if self._release_owned(lock_key, lock_value):
+                        pipe.delete(lock_key)
+                    else:
+                        # Queue EVALSHA directly: passing the Script object would make
+                        # execute() send SCRIPT EXISTS first, costing a second round-trip
+                        pipe.evalsha(self._release_script.sha, 1, lock_key, lock_value)
+                    pipe.hincrby(concurrency_key, lock_type, -1)
+                    released, count = await pipe.execute(raise_on_error=False)
+                if isinstance(released, RedisNoScriptError):
+                    # Script cache was flushed; the decrement still ran, so only
+                    # retry the release (the Script object reloads it)
+                    released = await self._release_script(keys=[lock_key], args=[lock_value])
+                for result in (released, count):
+                    if isinstance(result, Exception):
+                        raise result
+                if count < 0:
+                    await self._client.hset(concurrency_key, lock_type, 0)
+                return released == 1
+            except Exception as e:
+                print(f"⚠️ Failed to release Redis lock: {e}")
+                return False
+        else:
+            await self.decrement_concurrency(token_id, lock_type)
+            return False
+    
     async def is_token_locked(self, token_id: int, lock_type: str = "image") -> bool:
         """Check if a token is locked"""
-        key = f"token:{token_id}:{lock_type}"
+        key = _token_key(token_id, lock_type)
         return await self.is_locked(key)
     
     # ==================== Cloudflare Lock Operations ====================
@@ -244,13 +919,17 @@ class RedisManager:
     
     async def release_cf_lock(self):
         """Release Cloudflare refresh lock"""
-        # For CF lock, we just delete the key
-        if self._client:
+        # For CF lock, we just delete the key (in both stores, since it may
+        # have been taken during local fallback)
+        async with self._local_lock:
+            if "lock:cf:refresh" in self._local_locks:
+                self._release_local_lock("lock:cf:refresh")
+        if self._ready or await self._ensure_client():
+            self._owned.pop("lock:cf:refresh", None)
+            owned = self._owned_tasks.pop("lock:cf:refresh", None)
+            if owned is not None:
+                owned[1].cancel()
             await self._client.delete("lock:cf:refresh")
-        else:
-            async with self._local_lock:
-                if "lock:cf:refresh" in self._local_locks:
-                    del self._local_locks["lock:cf:refresh"]
     
     async def is_cf_refreshing(self) -> bool:
         """Check if CF credentials are being refreshed"""
@@ -267,37 +946,51 @@ class RedisManager:
     
     async def get_concurrency(self, token_id: int, lock_type: str) -> int:
         """Get current concurrency count for a token"""
-        key = f"concurrency:{token_id}:{lock_type}"
-        if self._client:
-            value = await self._client.get(key)
+        key = _concurrency_key(token_id)
+        if self._ready or await self._ensure_client():
+            value = await self._client.hget(key, lock_type)
             return int(value) if value else 0
         else:
-            return self._local_cache.get(key, 0)
+            return self._local_counters.get(key, {}).get(lock_type, 0)
+    
+    async def get_all_concurrency(self, token_id: int) -> dict[str, int]:
+        """Get concurrency counts for every lock type of a token"""
+        key = _concurrency_key(token_id)
+        if self._ready or await self._ensure_client():
+            values = await self._client.hgetall(key)
+            return {field.decode(): int(value) for field, value in values.items()}
+        else:
+            return dict(self._local_counters.get(key, {}))
     
     async def increment_concurrency(self, token_id: int, lock_type: str) -> int:
         """Increment concurrency count"""
-        key = f"concurrency:{token_id}:{lock_type}"
-        if self._client:
-            return await self._client.incr(key)
+        key = _concurrency_key(token_id)
+        if self._ready or await self._ensure_client():
+            return await self._client.hincrby(key, lock_type, 1)
         else:
-            current = self._local_cache.get(key, 0)
-            self._local_cache[key] = current + 1
-            return current + 1
+            counters = self._local_counters.setdefault(key, {})
+            counters[lock_type] = counters.get(lock_type, 0) + 1
+            return counters[lock_type]
     
     async def decrement_concurrency(self, token_id: int, lock_type: str) -> int:
-        """Decrement concurrency count"""
-        key = f"concurrency:{token_id}:{lock_type}"
-        if self._client:
-            result = await self._client.decr(key)
+        """
+        Decrement concurrency count
+        
+        Slots counted locally (during local fallback) are returned locally
+        first, so they are not stranded once Redis connects.
+        """
+        key = _concurrency_key(token_id)
+        counters = self._local_counters.get(key)
+        if counters and counters.get(lock_type, 0) > 0:
+            counters[lock_type] -= 1
+            return counters[lock_type]
+        if self._ready or await self._ensure_client():
+            result = await self._client.hincrby(key, lock_type, -1)
             if result < 0:
-                await self._client.set(key, 0)
+                await self._client.hset(key, lock_type, 0)
                 return 0
             return result
-        else:
-            current = self._local_cache.get(key, 0)
-            new_value = max(0, current - 1)
-            self._local_cache[key] = new_value
-            return new_value
+        return 0
 
 
 # Global Redis manager instance
@@ -18,7 +18,7 @@ class TokenLock:
         """
         self.lock_timeout = lock_timeout
         self._locks: Dict[int, float] = {}  # token_id -> lock_timestamp (local fallback)
-        self._lock_values: Dict[int, str] = {}  # token_id -> lock_value (for Redis)
+        self._lock_values: Dict[int, bytes] = {}  # token_id -> lock_value (for Redis)
         self._lock = asyncio.Lock()  # Protect _locks dict
         self._redis_manager = None
     
@@ -0,0 +1,475 @@
+"""Behaviour tests for RedisManager (local fallback and fakeredis-backed Redis)"""
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from src.core import redis_manager as rm
+from src.core.redis_manager import RedisManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _redis_manager(**fake_kwargs) -> RedisManager:
+    manager = RedisManager()
+    manager._client = fakeredis.FakeAsyncRedis(**fake_kwargs)
+    assert await manager._ensure_client()
+    return manager
+
+
+# ==================== Local locks ====================
+
+def test_local_waiter_wakes_on_release():
+    async def scenario():
+        manager = RedisManager()
+        holder = await manager.acquire_lock("k", timeout=10)
+        waiter = asyncio.create_task(manager.acquire_lock("k", timeout=10, wait_timeout=5))
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        assert await manager.release_lock("k", holder)
+        value = await waiter
+        elapsed = time.monotonic() - start
+        await manager.close()
+        return value, elapsed
+
+    value, elapsed = run(scenario())
+    assert value is not None
+    assert elapsed < 0.05
+
+
+def test_local_waiter_gives_up_after_wait_timeout():
+    async def scenario():
+        manager = RedisManager()
+        await manager.acquire_lock("k", timeout=10)
+        start = time.monotonic()
+        value = await manager.acquire_lock("k", timeout=10, wait_timeout=0.2)
+        elapsed = time.monotonic() - start
+        nonblocking = await manager.acquire_lock("k", timeout=10, blocking=False)
+        locked = manager._local_lock.locked()
+        await manager.close()
+        return value, elapsed, nonblocking, locked
+
+    value, elapsed, nonblocking, locked = run(scenario())
+    assert value is None
+    assert 0.2 <= elapsed < 0.5
+    assert nonblocking is None
+    assert not locked
+
+
+def test_local_lock_expires_and_wakes_waiter():
+    async def scenario():
+        manager = RedisManager()
+        await manager.acquire_lock("k", timeout=0.2)
+        start = time.monotonic()
+        value = await manager.acquire_lock("k", timeout=10, wait_timeout=2)
+        elapsed = time.monotonic() - start
+        await manager.close()
+        return value, elapsed
+
+    value, elapsed = run(scenario())
+    assert value is not None
+    assert elapsed < 0.5
+
+
+def test_local_expiry_skips_lock_reacquired_after_release():
+    async def scenario():
+        manager = RedisManager()
+        first = await manager.acquire_lock("k", timeout=0.2)
+        await manager.release_lock("k", first)
+        second = await manager.acquire_lock("k", timeout=10)
+        await asyncio.sleep(0.4)
+        still_held = manager._local_locks.get("lock:k") == second
+        await manager.close()
+        return still_held
+
+    assert run(scenario())
+
+
+def test_local_watchdog_lock_does_not_expire():
+    async def scenario():
+        manager = RedisManager()
+        value = await manager.acquire_lock("k", timeout=0.2, watchdog=True)
+        await asyncio.sleep(0.4)
+        locked = await manager.is_locked("k")
+        released = await manager.release_lock("k", value)
+        await manager.close()
+        return locked, released
+
+    assert run(scenario()) == (True, True)
+
+
+@pytest.mark.parametrize("use_redis", [False, True])
+def test_inspect_lock_describes_our_holder(use_redis):
+    async def scenario():
+        manager = await _redis_manager() if use_redis else RedisManager()
+        await manager.acquire_lock("k", timeout=10)
+        info = await manager.inspect_lock("k")
+        free = await manager.inspect_lock("free")
+        await manager.close()
+        return info, free
+
+    info, free = run(scenario())
+    assert free is None
+    assert len(info["id"]) == 32
+    assert info["pid"] == rm.os.getpid()
+    assert info["host_hash"] == rm._HOST_HASH
+    assert abs(info["acquired_at"] - time.time()) < 5
+
+
+@pytest.mark.parametrize("value", [
+    b"\x94\x01\x02\x03\x04",  # 4-item array of ints
+    b"\xa4abcd",  # 4-char string
+    b"\x94\xc4\x01x\x01\x02\xa1y",  # right shape, wrong last item
+    b"legacy-uuid-string",
+    b"",
+])
+def test_inspect_lock_ignores_foreign_values(value):
+    async def scenario():
+        manager = await _redis_manager()
+        await manager._client.set("lock:k", value)
+        info = await manager.inspect_lock("k")
+        await manager.close()
+        return info
+
+    assert run(scenario()) is None
+
+
+# ==================== Local cache ====================
+
+def test_local_cache_evicts_least_accessed(monkeypatch):
+    monkeypatch.setattr(rm, "LOCAL_CACHE_MAXSIZE", 3)
+
+    async def scenario():
+        manager = RedisManager()
+        for key in ("a", "b", "c"):
+            await manager.set(key, key)
+        for _ in range(3):
+            await manager.get("a")
+            await manager.get("c")
+        await manager.set("d", "d")
+        keys = sorted(manager._local_cache)
+        await manager.close()
+        return keys
+
+    assert run(scenario()) == ["a", "c", "d"]
+
+
+def test_local_cache_expires_entries():
+    async def scenario():
+        manager = RedisManager()
+        await manager.set("k", "v", ex=1)
+        before = await manager.get("k")
+        await asyncio.sleep(1.1)
+        after = await manager.get("k")
+        await manager.close()
+        return before, after
+
+    assert run(scenario()) == (b"v", None)
+
+
+def test_local_cache_counters_are_halved_when_saturated(monkeypatch):
+    monkeypatch.setattr(rm, "LOCAL_CACHE_COUNTER_LIMIT", 4)
+    monkeypatch.setattr(rm, "LOCAL_CACHE_SWEEP_INTERVAL", 0.01)
+
+    async def scenario():
+        manager = RedisManager()
+        await manager.set("hot", "1")
+        await manager.set("cold", "1")
+        for _ in range(5):
+            await manager.get("hot")
+        assert manager._local_cache_saturated
+        await asyncio.sleep(0.05)
+        counts = {key: entry[2] for key, entry in manager._local_cache.items()}
+        saturated = manager._local_cache_saturated
+        await manager.close()
+        return counts, saturated
+
+    counts, saturated = run(scenario())
+    assert counts == {"hot": 3, "cold": 0}
+    assert not saturated
+
+
+# ==================== Redis locks ====================
+
+def test_watchdog_renews_until_release():
+    async def scenario():
+        manager = await _redis_manager()
+        value = await manager.acquire_lock("w", timeout=1, watchdog=True)
+        await asyncio.sleep(1.5)
+        held = await manager.is_locked("w")
+        released = await manager.release_lock("w", value)
+        tasks = dict(manager._owned_tasks)
+        await manager.close()
+        return held, released, tasks
+
+    held, released, tasks = run(scenario())
+    assert held
+    assert released
+    assert tasks == {}
+
+
+def test_lock_without_watchdog_expires():
+    async def scenario():
+        manager = await _redis_manager()
+        await manager.acquire_lock("w", timeout=1)
+        await asyncio.sleep(1.2)
+        held = await manager.is_locked("w")
+        await manager.close()
+        return held
+
+    assert not run(scenario())
+
+
+def test_watchdog_stops_when_lock_is_lost():
+    async def scenario():
+        manager = await _redis_manager()
+        await manager.acquire_lock("w", timeout=1, watchdog=True)
+        await manager._client.delete("lock:w")
+        await asyncio.sleep(0.5)
+        tasks = dict(manager._owned_tasks)
+        await manager.close()
+        return tasks
+
+    assert run(scenario()) == {}
+
+
+def test_slow_acquire_reply_does_not_extend_ownership(monkeypatch):
+    monkeypatch.setattr(rm, "LOCK_OWNERSHIP_MARGIN", 0.5)
+
+    async def scenario():
+        manager = await _redis_manager()
+        set_nx = manager._set_nx
+
+        async def slow_reply(*args):
+            result = await set_nx(*args)
+            await asyncio.sleep(0.6)
+            return result
+
+        manager._set_nx = slow_reply
+        value = await manager.acquire_lock("k", timeout=1)
+        # The lock expired and someone else took it; a plain DEL would remove theirs
+        await manager._client.set("lock:k", b"other")
+        released = await manager.release_lock("k", value)
+        holder = await manager._client.get("lock:k")
+        await manager.close()
+        return released, holder
+
+    assert run(scenario()) == (False, b"other")
+
+
+def test_try_acquire_reports_holder_on_redis_7():
+    async def scenario():
+        manager = await _redis_manager(version=(7, 0))
+        value, _ = await manager.try_acquire_lock("k", timeout=10)
+        second, holder = await manager.try_acquire_lock("k", timeout=10)
+        supported = manager._set_get_supported
+        await manager.close()
+        return value, second, holder, supported
+
+    value, second, holder, supported = run(scenario())
+    assert second is None
+    assert holder == value
+    assert supported
+
+
+def test_set_nx_get_falls_back_on_old_servers():
+    async def scenario():
+        manager = await _redis_manager(version=(6, 2))
+        value, _ = await manager.try_acquire_lock("k", timeout=10)
+        second, holder = await manager.try_acquire_lock("k", timeout=10)
+        supported = manager._set_get_supported
+        released = await manager.release_lock("k", value)
+        await manager.close()
+        return value, second, holder, supported, released
+
+    value, second, holder, supported, released = run(scenario())
+    assert value is not None
+    assert (second, holder) == (None, None)
+    assert not supported
+    assert released
+
+
+def test_token_lock_and_counter_round_trip():
+    async def scenario():
+        manager = await _redis_manager()
+        value = await manager.acquire_token_lock_and_incr(1, "image", 30)
+        again = await manager.acquire_token_lock_and_incr(1, "image", 30)
+        during = await manager.get_all_concurrency(1)
+        released = await manager.release_token_lock_and_decr(1, "image", value)
+        after = await manager.get_all_concurrency(1)
+        await manager.close()
+        return again, during, released, after
+
+    assert run(scenario()) == (None, {"image": 1}, True, {"image": 0})
+
+
+# ==================== Connection setup ====================
+
+def test_concurrent_callers_share_one_failed_connect(monkeypatch):
+    async def scenario():
+        manager = RedisManager()
+        manager._client = fakeredis.FakeAsyncRedis()
+        attempts = 0
+
+        async def failing_connect():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.05)
+            raise rm.RedisConnectionError("refused")
+
+        monkeypatch.setattr(manager, "_connect", failing_connect)
+        results = await asyncio.gather(*[manager._ensure_client() for _ in range(10)])
+        during_cooldown = await manager._ensure_client()
+        fallback = await manager.acquire_lock("k", blocking=False)
+        await manager.close()
+        return attempts, results, during_cooldown, fallback
+
+    attempts, results, during_cooldown, fallback = run(scenario())
+    assert attempts == 1
+    assert results == [False] * 10
+    assert not during_cooldown
+    assert fallback is not None
+
+
+def test_callers_do_not_wait_for_a_connect_in_progress(monkeypatch):
+    async def scenario():
+        manager = RedisManager()
+        manager._client = fakeredis.FakeAsyncRedis()
+
+        async def slow_failing_connect():
+            await asyncio.sleep(0.5)
+            raise rm.RedisConnectionError("timed out")
+
+        monkeypatch.setattr(manager, "_connect", slow_failing_connect)
+        connecting = asyncio.create_task(manager._ensure_client())
+        await asyncio.sleep(0)
+
+        async def timed_acquire(i):
+            start = time.monotonic()
+            value = await manager.acquire_lock(f"k{i}", blocking=False)
+            return value, time.monotonic() - start
+
+        results = await asyncio.gather(*[timed_acquire(i) for i in range(5)])
+        await connecting
+        await manager.close()
+        return results
+
+    for value, elapsed in run(scenario()):
+        assert value is not None
+        assert elapsed < 0.1
+
+
+def test_connect_retries_after_cooldown(monkeypatch):
+    monkeypatch.setattr(rm, "CONNECT_RETRY_COOLDOWN", 0.05)
+
+    async def scenario():
+        manager = RedisManager()
+        manager._client = fakeredis.FakeAsyncRedis()
+        real_connect = manager._connect
+        calls = 0
+
+        async def flaky_connect():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise rm.RedisConnectionError("refused")
+            await real_connect()
+
+        monkeypatch.setattr(manager, "_connect", flaky_connect)
+        first = await manager._ensure_client()
+        await asyncio.sleep(0.1)
+        second = await manager._ensure_client()
+        await manager.close()
+        return first, second
+
+    assert run(scenario()) == (False, True)
+
+
+def test_retry_decorator_backs_off_then_raises(monkeypatch):
+    monkeypatch.setattr(rm, "CONNECT_RETRY_DELAY", 0.001)
+    calls = 0
+
+    @rm._retry_on_connection_error
+    async def always_fails():
+        nonlocal calls
+        calls += 1
+        raise rm.RedisConnectionError("refused")
+
+    with pytest.raises(rm.RedisConnectionError):
+        run(always_fails())
+    assert calls == rm.CONNECT_RETRY_ATTEMPTS
+
+
+def test_fallback_lock_is_released_locally_after_reconnect():
+    async def scenario():
+        manager = RedisManager()
+        manager._client = fakeredis.FakeAsyncRedis()
+        manager._connect_retry_at = float("inf")
+        value = await manager.acquire_token_lock_and_incr(7, "image", 10)
+        manager._connect_retry_at = 0.0
+        assert await manager._ensure_client()
+        released = await manager.release_token_lock_and_decr(7, "image", value)
+        state = (dict(manager._local_locks), manager._local_counters)
+        await manager.close()
+        return value, released, state
+
+    value, released, (locks, counters) = run(scenario())
+    assert value is not None
+    assert released
+    assert locks == {}
+    assert counters == {"concurrency:7": {"image": 0}}
+
+
+# ==================== Read batching ====================
+
+def test_concurrent_reads_share_one_pipeline():
+    async def scenario():
+        manager = await _redis_manager()
+        await manager.set("a", "1")
+        await manager.acquire_lock("held", timeout=10)
+        pipelines = 0
+        make_pipeline = manager._client.pipeline
+
+        def counting_pipeline(*args, **kwargs):
+            nonlocal pipelines
+            pipelines += 1
+            return make_pipeline(*args, **kwargs)
+
+        manager._client.pipeline = counting_pipeline
+        results = await asyncio.gather(
+            manager.is_locked("held"),
+            manager.is_locked("free"),
+            manager.exists("a"),
+            manager.get("a"),
+            manager.get("missing"),
+        )
+        await manager.close()
+        return pipelines, results
+
+    pipelines, results = run(scenario())
+    assert pipelines == 1
+    assert results == [True, False, True, b"1", None]
+
+
+def test_single_read_is_not_held_for_a_window():
+    async def scenario():
+        manager = await _redis_manager()
+        await manager.acquire_lock("held", timeout=10)
+        rounds = 200
+        start = time.monotonic()
+        for _ in range(rounds):
+            await manager._client.exists("lock:held")
+        direct = time.monotonic() - start
+        start = time.monotonic()
+        for _ in range(rounds):
+            assert await manager.is_locked("held")
+        batched = time.monotonic() - start
+        await manager.close()
+        return direct, batched
+
+    direct, batched = run(scenario())
+    # A fixed coalescing window costs ~1ms per call, far more than a fakeredis round-trip
+    assert batched < direct * 3